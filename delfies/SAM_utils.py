@@ -1,13 +1,16 @@
+import os
 from dataclasses import dataclass
 from functools import reduce
+from pathlib import Path
 from typing import Optional
 
 from pysam import CSOFT_CLIP, AlignedSegment
 
 from delfies import Orientation
+from delfies.interval_utils import SLOTTED_DATACLASS
 
 
-@dataclass
+@dataclass(**SLOTTED_DATACLASS)
 class SoftclippedRead:
     """
     `sc`: position of softclip start, located at read extremity
@@ -59,19 +62,50 @@ def find_softclip_at_extremity(
     In the returned object, we return the position of the first softclipped position in
     both reference and read (query). If in forward orientation in the read,
     no adjustment is needed, and if in reverse orientation, we subtract one.
+
+    The read sequence only gets copied out of the pysam record if a softclip is found,
+    as most reads do not have one.
     """
-    result = SoftclippedRead(read.query_sequence, read.query_name, None, None, None)
     if orientation is Orientation.forward:
-        if read.cigartuples[-1][0] == CSOFT_CLIP:
-            result.sc_ref = read.reference_end
-            result.sc_query = read.query_alignment_end
-            result.sc_length = len(result.sequence) - result.sc_query
+        if read.cigartuples[-1][0] != CSOFT_CLIP:
+            return None
+        sc_ref = read.reference_end
+        sc_query = read.query_alignment_end
+        sequence = read.query_sequence
+        sc_length = len(sequence) - sc_query
     else:
-        if read.cigartuples[0][0] == CSOFT_CLIP:
-            result.sc_ref = read.reference_start - 1
-            result.sc_query = read.query_alignment_start - 1
-            result.sc_length = result.sc_query + 1
-    if result.sc_ref is None:
+        if read.cigartuples[0][0] != CSOFT_CLIP:
+            return None
+        sc_ref = read.reference_start - 1
+        sc_query = read.query_alignment_start - 1
+        sequence = read.query_sequence
+        sc_length = sc_query + 1
+    if sc_ref is None:
         return None
-    else:
-        return result
+    return SoftclippedRead(sequence, read.query_name, sc_ref, sc_query, sc_length)
+
+
+def advise_sequential_reads(fname: str) -> int:
+    """
+    Tells the kernel that file descriptors this process holds on `fname` (e.g. the
+    one used by htslib after opening a BAM) will be read sequentially, which enlarges
+    their readahead window. No root privileges are needed.
+
+    Only supported on Linux: elsewhere, this is a no-op.
+    Returns the number of file descriptors advised.
+    """
+    proc_fds = Path("/proc/self/fd")
+    if not hasattr(os, "posix_fadvise") or not proc_fds.is_dir():
+        return 0
+    target = os.path.realpath(fname)
+    num_advised = 0
+    for proc_fd in proc_fds.iterdir():
+        try:
+            if os.path.realpath(proc_fd) != target:
+                continue
+            os.posix_fadvise(int(proc_fd.name), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            num_advised += 1
+        except OSError:
+            # e.g. the descriptor got closed in the meantime
+            continue
+    return num_advised
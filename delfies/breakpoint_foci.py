@@ -3,12 +3,11 @@ Functions to find breakpoint foci. Definition: I call a breakpoint focus (plural
 location at which 1+ reads are found bearing softclips compatible with a PDE breakpoint.
 """
 
-from collections import defaultdict
-from itertools import chain as it_chain
-from typing import Dict, List
+from io import TextIOWrapper
+from typing import List, Optional
 
 from datasci import Tent, Tents
-from pysam import AlignedSegment, AlignmentFile
+from pysam import AlignedSegment, AlignmentFile, BGZFile
 
 from delfies import (
     ID_DELIM,
@@ -18,13 +17,17 @@ from delfies import (
     Orientation,
     PutativeBreakpoint,
 )
-from delfies.interval_utils import Interval, get_contiguous_ranges
+from delfies.interval_utils import ContigChunk, Interval, get_contiguous_ranges
 from delfies.SAM_utils import find_softclip_at_extremity, read_flag_matches
 from delfies.telomere_utils import has_softclipped_telo_array
 
 READ_SUPPORTS = [
     f"{READ_SUPPORT_PREFIX}{ID_DELIM}{o}" for o in map(lambda e: e.name, Orientation)
 ]
+READ_SUPPORT_ORIENTATIONS = {
+    read_support: Orientation[read_support.split(ID_DELIM)[1]]
+    for read_support in READ_SUPPORTS
+}
 
 
 def setup_breakpoint_tents() -> Tents:
@@ -39,6 +42,16 @@ def setup_breakpoint_tents() -> Tents:
     return tents
 
 
+def write_breakpoint_foci(breakpoint_foci: Tents, foci_tsv: str) -> None:
+    """
+    Writes a bgzip-compressed TSV, one row at a time, rather than first
+    serialising all foci into a single string.
+    """
+    with TextIOWrapper(BGZFile(foci_tsv, "wb")) as ofstream:
+        ofstream.write(f"{breakpoint_foci.get_header()}\n")
+        ofstream.writelines(f"{focus!r}\n" for focus in breakpoint_foci)
+
+
 ####################
 ## Foci detection ##
 ####################
@@ -56,11 +69,17 @@ def record_softclips(
     detection_params: BreakpointDetectionParams,
     seq_region: Interval,
 ) -> None:
-    for read_support in READ_SUPPORTS:
-        orientation = Orientation[read_support.split(ID_DELIM)[1]]
+    # In G2S mode, and in contig chunks (so that reads overlapping two chunks
+    # are not counted twice), softclips must start inside the analysed region
+    restrict_to_region = isinstance(seq_region, ContigChunk) or (
+        detection_params.breakpoint_type is BreakpointType.G2S
+    )
+    for read_support, orientation in READ_SUPPORT_ORIENTATIONS.items():
         softclipped_read = find_softclip_at_extremity(aligned_read, orientation)
         if softclipped_read is None:
             continue
+        if restrict_to_region and not seq_region.spans(softclipped_read.sc_ref):
+            continue
         if detection_params.breakpoint_type is BreakpointType.G2S:
             # In G2S mode, we reject softclipped telomeres occurring in any orientation
             softclipped_telo_array_found = False
@@ -72,13 +91,7 @@ def record_softclips(
                     min_telo_array_size=3,
                     max_edit_distance=detection_params.max_edit_distance,
                 )
-            softclips_start_inside_target_region = seq_region.spans(
-                softclipped_read.sc_ref
-            )
-            keep_read = (
-                softclips_start_inside_target_region
-                and not softclipped_telo_array_found
-            )
+            keep_read = not softclipped_telo_array_found
         else:
             softclipped_telo_array_found = has_softclipped_telo_array(
                 softclipped_read,
@@ -110,17 +123,31 @@ def record_softclips(
 def find_breakpoint_foci(
     detection_params: BreakpointDetectionParams,
     seq_region: Interval,
+    bam_fstream: Optional[AlignmentFile] = None,
 ) -> Tents:
+    """
+    `bam_fstream`: an already-opened handle to `detection_params.bam_fname`, allowing
+    callers processing many regions to reuse it. If not provided, the BAM gets opened here.
+    """
     breakpoint_foci = setup_breakpoint_tents()
     breakpoint_foci_positions = {}
     contig_name = seq_region.name
-    if seq_region.has_coordinates():
+    if isinstance(seq_region, ContigChunk):
+        # Padding ensures we see all reads whose softclips start inside the chunk,
+        # including those with a softclip starting just past an alignment end
+        fetch_args = dict(
+            contig=contig_name,
+            start=max(seq_region.start - 1, 0),
+            stop=seq_region.end + 2,
+        )
+    elif seq_region.has_coordinates():
         fetch_args = dict(
             contig=contig_name, start=seq_region.start, stop=seq_region.end
         )
     else:
         fetch_args = dict(contig=contig_name)
-    bam_fstream = AlignmentFile(detection_params.bam_fname)
+    if bam_fstream is None:
+        bam_fstream = AlignmentFile(detection_params.bam_fname)
     for aligned_read in bam_fstream.fetch(**fetch_args):
         if aligned_read.mapping_quality < detection_params.min_mapq:
             continue
@@ -255,21 +282,28 @@ class FociWindow:
 
 def cluster_breakpoint_foci(foci: Tents, tolerance: int) -> List[FociWindow]:
     """
+    Foci are sorted by position, and then swept through once: each focus either
+    extends the current window or starts a new one. This makes clustering
+    independent of the order in which foci were found.
+
     Developer note:
         foci without any softclipped-reads are ignored for the purpose of clustering,
         as they are only present in the output tsv to assess coverage changes near breakpoints.
     """
-    result: Dict[str, List[FociWindow]] = defaultdict(list)
-    for focus in foci:
-        if not focus_has_enough_support(focus, 1):
-            continue
-        contig_windows = result[focus.contig]
-        found_window = False
-        for elem in contig_windows:
-            if elem.includes(focus, tolerance=tolerance):
-                elem.add(focus)
-                found_window = True
-                break
-        if not found_window:
-            contig_windows.append(FociWindow(focus))
-    return list(it_chain(*result.values()))
+    supported_foci = sorted(
+        (focus for focus in foci if focus_has_enough_support(focus, 1)),
+        key=lambda focus: (focus.contig, int(focus.start), int(focus.end)),
+    )
+    result: List[FociWindow] = list()
+    current_window = None
+    for focus in supported_foci:
+        if (
+            current_window is not None
+            and current_window.foci[0].contig == focus.contig
+            and current_window.includes(focus, tolerance=tolerance)
+        ):
+            current_window.add(focus)
+        else:
+            current_window = FociWindow(focus)
+            result.append(current_window)
+    return result
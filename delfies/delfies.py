@@ -1,9 +1,15 @@
-import itertools as it
+import heapq
 import multiprocessing as mp
+import os
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain as it_chain
+from itertools import groupby
 from pathlib import Path
+from typing import Callable, List, Optional, Set, Tuple
 
 import rich_click as click
-from pybedtools import BedTool
+from datasci import Tent, Tents
 from pyfastx import Fasta
 from pysam import AlignmentFile
 
@@ -17,26 +23,32 @@ from delfies import (
     all_breakpoint_types,
 )
 from delfies.breakpoint_foci import (
+    READ_SUPPORTS,
     BreakpointDetectionParams,
     cluster_breakpoint_foci,
     find_breakpoint_foci,
     setup_breakpoint_tents,
+    write_breakpoint_foci,
 )
 from delfies.breakpoint_sequences import write_breakpoint_sequences
-from delfies.interval_utils import Interval, Intervals
+from delfies.interval_utils import Interval, Intervals, read_bed, split_contig
 from delfies.SAM_utils import (
     DEFAULT_MIN_MAPQ,
     DEFAULT_READ_FILTER_FLAG,
     DEFAULT_READ_FILTER_NAMES,
+    advise_sequential_reads,
 )
 from delfies.seq_utils import find_all_occurrences_in_genome, rev_comp
-from delfies.telomere_utils import TELOMERE_SEQS, remove_breakpoints_in_telomere_arrays
+from delfies.telomere_utils import (
+    TELOMERE_SEQS,
+    remove_breakpoints_in_telomere_arrays,
+)
 
 click.rich_click.OPTION_GROUPS = {
     "delfies": [
         {
             "name": "Generic",
-            "options": ["--help", "--version", "--threads"],
+            "options": ["--help", "--version", "--threads", "--pin_threads"],
         },
         {
             "name": "Region selection",
@@ -65,23 +77,243 @@ click.rich_click.OPTION_GROUPS = {
 }
 
 
+# Whole contigs longer than this get analysed in several chunks, to balance load
+# across threads on genomes with skewed contig lengths
+REGION_CHUNK_SIZE = 5_000_000
+
+# Maximum number of extra (htslib) threads a process uses for BAM decompression
+MAX_BAM_DECOMPRESSION_THREADS = 2
+
+# Set once per pool worker by `_init_worker`, so that detection parameters are pickled
+# and the BAM is opened once per worker rather than once per analysed region
+_worker_detection_params: BreakpointDetectionParams = None
+_worker_bam_fstream: AlignmentFile = None
+
+
+def get_decompression_threads(num_processes: int, thread_budget: int) -> int:
+    """
+    Number of BAM decompression threads each of `num_processes` processes can start
+    while keeping the total number of busy threads within `thread_budget`
+    (each process already runs one thread itself).
+    """
+    return max(
+        0, min(MAX_BAM_DECOMPRESSION_THREADS, thread_budget // num_processes - 1)
+    )
+
+
+def open_bam_for_detection(
+    bam_fname: str, decompression_threads: int = 0
+) -> AlignmentFile:
+    # pysam's `threads` is the size of the htslib thread pool, which is only
+    # created for values above 1
+    bam_fstream = AlignmentFile(bam_fname, threads=max(decompression_threads, 1))
+    advise_sequential_reads(bam_fname)
+    return bam_fstream
+
+
+def get_worker_cpu_sets(num_workers: int) -> Optional[List[Set[int]]]:
+    """
+    Splits the CPUs this process may run on into `num_workers` disjoint blocks of
+    consecutive CPU ids (which usually share a NUMA node).
+    Returns None if CPU pinning is unsupported (non-Linux) or there are fewer CPUs
+    than workers.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+    available_cpus = sorted(os.sched_getaffinity(0))
+    cpus_per_worker = len(available_cpus) // num_workers
+    if cpus_per_worker == 0:
+        return None
+    return [
+        set(available_cpus[i * cpus_per_worker : (i + 1) * cpus_per_worker])
+        for i in range(num_workers)
+    ]
+
+
+def _init_worker(
+    detection_params: BreakpointDetectionParams,
+    decompression_threads: int = 0,
+    worker_cpu_sets: Optional[List[Set[int]]] = None,
+    worker_counter=None,
+) -> None:
+    global _worker_detection_params, _worker_bam_fstream
+    if worker_cpu_sets is not None:
+        with worker_counter.get_lock():
+            worker_index = worker_counter.value
+            worker_counter.value += 1
+        # Done before opening the BAM, so that htslib threads inherit the CPU set
+        os.sched_setaffinity(0, worker_cpu_sets[worker_index % len(worker_cpu_sets)])
+    _worker_detection_params = detection_params
+    _worker_bam_fstream = open_bam_for_detection(
+        detection_params.bam_fname, decompression_threads
+    )
+
+
+def _find_breakpoint_foci_in_worker(
+    indexed_seq_region: Tuple[int, Interval],
+) -> Tuple[int, Tents]:
+    region_index, seq_region = indexed_seq_region
+    return region_index, find_breakpoint_foci(
+        _worker_detection_params, seq_region, _worker_bam_fstream
+    )
+
+
+def get_pool_context() -> mp.context.BaseContext:
+    """
+    Where available, workers are started from a 'forkserver' process that has already
+    imported delfies and its dependencies, instead of forking the main process
+    (whose memory can be large, e.g. after indexing the genome).
+    """
+    if "forkserver" not in mp.get_all_start_methods():
+        return mp.get_context()
+    mp_context = mp.get_context("forkserver")
+    mp_context.set_forkserver_preload([__name__])
+    return mp_context
+
+
+def split_long_contigs(
+    seq_regions: Intervals, contig_lengths: dict, chunk_size: int = REGION_CHUNK_SIZE
+) -> Intervals:
+    """
+    Only regions spanning entire contigs get split; foci found on either side of a
+    split get merged back together during clustering.
+    """
+    result = list()
+    for seq_region in seq_regions:
+        contig_length = contig_lengths.get(seq_region.name, 0)
+        if seq_region.has_coordinates() or contig_length <= chunk_size:
+            result.append(seq_region)
+        else:
+            result.extend(split_contig(seq_region.name, contig_length, chunk_size))
+    return result
+
+
+def sort_regions_by_size(seq_regions: Intervals, contig_lengths: dict) -> Intervals:
+    """
+    Largest regions first, so that long contigs do not get processed last
+    and stall the whole pool (longest-processing-time-first scheduling).
+    """
+
+    def region_size(seq_region: Interval) -> int:
+        if seq_region.has_coordinates():
+            return seq_region.end - seq_region.start
+        return contig_lengths.get(seq_region.name, 0)
+
+    return sorted(seq_regions, key=region_size, reverse=True)
+
+
+class BackgroundWriter:
+    """
+    Runs output-writing functions in background threads, so that writing overlaps
+    with further computation. Errors raised while writing get re-raised by `join`.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending_writes: List[Future] = list()
+
+    def submit(self, write_function: Callable, *args) -> None:
+        self._pending_writes.append(self._executor.submit(write_function, *args))
+
+    def join(self) -> None:
+        self._executor.shutdown(wait=True)
+        for pending_write in self._pending_writes:
+            pending_write.result()
+
+
+def sort_foci_by_position(
+    foci_per_region: List[Tents], contig_order: List[str]
+) -> Tents:
+    """
+    Orders foci by contig (in `contig_order`, e.g. that of the BAM header), then by
+    position. This makes output independent of the order in which regions finished
+    being processed.
+    Positions output by several regions (e.g. read depth recorded next to a focus
+    near a contig chunk boundary) are output once, keeping the row with the most
+    read support; ties are broken by the order of `foci_per_region`.
+    """
+    contig_indices = {contig: i for i, contig in enumerate(contig_order)}
+
+    def focus_position(focus: Tent) -> Tuple[int, str, int]:
+        contig_index = contig_indices.get(focus.contig, len(contig_indices))
+        return contig_index, focus.contig, int(focus.start)
+
+    def focus_read_support(focus: Tent) -> int:
+        return sum(int(focus[read_support]) for read_support in READ_SUPPORTS)
+
+    result = setup_breakpoint_tents()
+    sorted_foci = sorted(it_chain.from_iterable(foci_per_region), key=focus_position)
+    for _, same_position_foci in groupby(sorted_foci, key=focus_position):
+        result.add(max(same_position_foci, key=focus_read_support))
+    return result
+
+
 def run_breakpoint_detection(
-    detection_params: BreakpointDetectionParams, seq_regions: Intervals, threads
+    detection_params: BreakpointDetectionParams,
+    seq_regions: Intervals,
+    threads,
+    pin_threads: bool = False,
+    writer: Optional[BackgroundWriter] = None,
 ) -> PutativeBreakpoints:
-    with mp.Pool(processes=threads) as pool:
-        pooled_results = pool.starmap(
-            find_breakpoint_foci,
-            zip(
-                it.repeat(detection_params),
-                seq_regions,
+    """
+    `writer`: if provided, the foci TSV gets written in the background while
+    clustering (and whatever the caller does next) proceeds.
+    """
+    with AlignmentFile(detection_params.bam_fname) as bam_fstream:
+        contig_lengths = dict(zip(bam_fstream.references, bam_fstream.lengths))
+    seq_regions = split_long_contigs(seq_regions, contig_lengths)
+    seq_regions = sort_regions_by_size(seq_regions, contig_lengths)
+    foci_per_region: List[Tents] = [None] * len(seq_regions)
+    # Threads requested by the user are the budget for both detection processes and
+    # their BAM decompression threads
+    thread_budget = threads
+    if threads == 1 or len(seq_regions) <= 1:
+        # No need to pay for starting up worker processes
+        decompression_threads = get_decompression_threads(1, thread_budget)
+        with open_bam_for_detection(
+            detection_params.bam_fname, decompression_threads
+        ) as bam_fstream:
+            for region_index, seq_region in enumerate(seq_regions):
+                foci_per_region[region_index] = find_breakpoint_foci(
+                    detection_params, seq_region, bam_fstream
+                )
+    else:
+        threads = min(threads, len(seq_regions))
+        chunksize = max(1, len(seq_regions) // (threads * 4))
+        decompression_threads = get_decompression_threads(threads, thread_budget)
+        mp_context = get_pool_context()
+        worker_cpu_sets, worker_counter = None, None
+        if pin_threads:
+            worker_cpu_sets = get_worker_cpu_sets(threads)
+            if worker_cpu_sets is None:
+                warnings.warn(
+                    "Not pinning threads to CPUs: unsupported on this platform, "
+                    f"or fewer available CPUs than threads ({threads})"
+                )
+            else:
+                worker_counter = mp_context.Value("i", 0)
+        with mp_context.Pool(
+            processes=threads,
+            initializer=_init_worker,
+            initargs=(
+                detection_params,
+                decompression_threads,
+                worker_cpu_sets,
+                worker_counter,
             ),
-        )
-    all_foci = setup_breakpoint_tents()
-    for result in pooled_results:
-        all_foci.extend(result)
-    foci_tsv = f"{detection_params.ofname_base}.tsv"
-    with open(foci_tsv, "w") as ofstream:
-        print(all_foci, file=ofstream)
+        ) as pool:
+            for region_index, result in pool.imap_unordered(
+                _find_breakpoint_foci_in_worker,
+                enumerate(seq_regions),
+                chunksize=chunksize,
+            ):
+                foci_per_region[region_index] = result
+    all_foci = sort_foci_by_position(foci_per_region, list(contig_lengths))
+    foci_tsv = f"{detection_params.ofname_base}.tsv.gz"
+    if writer is None:
+        write_breakpoint_foci(all_foci, foci_tsv)
+    else:
+        writer.submit(write_breakpoint_foci, all_foci, foci_tsv)
     clustered_foci = cluster_breakpoint_foci(
         all_foci, tolerance=detection_params.clustering_threshold
     )
@@ -100,19 +332,13 @@ def write_breakpoint_bed(
     putative_breakpoints: PutativeBreakpoints, odirname: str
 ) -> None:
     breakpoint_bed = odirname / "breakpoint_locations.bed"
-    with breakpoint_bed.open("w") as ofstream:
-        for putative_breakpoint in putative_breakpoints:
-            strand = putative_breakpoint.orientation.value
-            breakpoint_name = f"Type:{putative_breakpoint.breakpoint_type};breakpoint_window:{putative_breakpoint.interval[0]}-{putative_breakpoint.interval[1]}"
-            out_line = [
-                putative_breakpoint.focus.contig,
-                putative_breakpoint.focus.start,
-                putative_breakpoint.focus.end,
-                breakpoint_name,
-                putative_breakpoint.max_value,
-                strand,
-            ]
-            ofstream.write("\t".join(map(str, out_line)) + "\n")
+    bed_lines = [
+        f"{putative_breakpoint.focus.contig}\t{putative_breakpoint.focus.start}\t{putative_breakpoint.focus.end}\t"
+        f"Type:{putative_breakpoint.breakpoint_type};breakpoint_window:{putative_breakpoint.interval[0]}-{putative_breakpoint.interval[1]}\t"
+        f"{putative_breakpoint.max_value}\t{putative_breakpoint.orientation.value}\n"
+        for putative_breakpoint in putative_breakpoints
+    ]
+    breakpoint_bed.write_text("".join(bed_lines))
 
 
 @click.command()
@@ -190,6 +416,12 @@ def write_breakpoint_bed(
     default="all",
 )
 @click.option("--threads", type=int, default=1)
+@click.option(
+    "--pin_threads",
+    is_flag=True,
+    help="Pin each thread to its own set of CPUs (Linux only). "
+    "Can improve throughput on multi-socket servers; avoid if other jobs run on the same CPUs",
+)
 @click.help_option("--help", "-h")
 @click.version_option(__version__, "--version", "-V")
 def main(
@@ -208,6 +440,7 @@ def main(
     seq_window_size,
     breakpoint_type,
     threads,
+    pin_threads,
 ):
     """
     Looks for DNA Elimination breakpoints from a bam of reads aligned to a genome.
@@ -217,19 +450,22 @@ def main(
     odirname = Path(odirname)
     odirname.mkdir(parents=True, exist_ok=True)
     ofname_base = odirname / "breakpoint_foci"
-    bam_fstream = AlignmentFile(bam_fname)
+    # The genome gets indexed (if not already) once, up-front and before any
+    # detection worker is started. Later openings of the genome, e.g. in
+    # `write_breakpoint_sequences`, reuse the index file.
+    genome_fasta = Fasta(genome_fname, build_index=True, uppercase=True)
+    with AlignmentFile(bam_fname) as bam_fstream:
+        references = bam_fstream.references
 
     seq_regions: Intervals = list()
     if bed is not None:
-        intervals = BedTool(bed)
-        for interval in intervals:
-            seq_regions.append(Interval.from_pybedtools_interval(interval))
+        seq_regions = read_bed(bed)
     elif seq_region is not None:
         seq_regions.append(Interval.from_region_string(seq_region))
         threads = 1
     else:
         # Analyse the entire genome
-        for contig in bam_fstream.references:
+        for contig in references:
             seq_regions.append(Interval(contig))
 
     telomere_seqs = {
@@ -254,44 +490,61 @@ def main(
     except ValueError:
         breakpoint_types_to_analyse = all_breakpoint_types
 
-    identified_breakpoints = []
-    genome_fasta = Fasta(genome_fname, build_index=True, uppercase=True)
+    breakpoints_per_type = []
+    writer = BackgroundWriter()
     searched_telo_unit = detection_params.telomere_seqs[Orientation.forward]
     searched_telo_array = searched_telo_unit * detection_params.telo_array_size
     interval_window_size = len(searched_telo_array)
+    # Computed at most once, and kept separate from `seq_regions` so that other
+    # breakpoint types still analyse all requested regions
+    telomere_containing_regions = None
     for breakpoint_type_to_analyse in breakpoint_types_to_analyse:
         detection_params.breakpoint_type = breakpoint_type_to_analyse
         detection_params.ofname_base = (
             f"{ofname_base}{ID_DELIM}{breakpoint_type_to_analyse}"
         )
+        regions_to_analyse = seq_regions
         if breakpoint_type_to_analyse is BreakpointType.G2S:
             # Restrict regions to analyse to those containing telomere arrays
-            seq_regions = find_all_occurrences_in_genome(
-                searched_telo_array,
-                genome_fasta,
-                seq_regions,
-                interval_window_size,
-            )
+            if telomere_containing_regions is None:
+                telomere_containing_regions = find_all_occurrences_in_genome(
+                    searched_telo_array,
+                    genome_fasta,
+                    seq_regions,
+                    interval_window_size,
+                )
+            regions_to_analyse = telomere_containing_regions
         candidate_breakpoints = run_breakpoint_detection(
-            detection_params, seq_regions, threads
+            detection_params, regions_to_analyse, threads, pin_threads, writer
         )
 
         if breakpoint_type_to_analyse is BreakpointType.S2G:
             # Excludes (read-based) telomere extensions in existing (genomic) telomere arrays
-            identified_breakpoints += remove_breakpoints_in_telomere_arrays(
-                genome_fasta,
-                searched_telo_array,
-                interval_window_size,
-                candidate_breakpoints,
+            breakpoints_per_type.append(
+                remove_breakpoints_in_telomere_arrays(
+                    genome_fasta,
+                    searched_telo_array,
+                    interval_window_size,
+                    candidate_breakpoints,
+                )
             )
         else:
-            identified_breakpoints += candidate_breakpoints
+            breakpoints_per_type.append(candidate_breakpoints)
 
-    write_breakpoint_bed(identified_breakpoints, odirname)
+    # Each breakpoint type's results are already sorted by decreasing read support
+    identified_breakpoints = list(
+        heapq.merge(*breakpoints_per_type, key=lambda e: e.max_value, reverse=True)
+    )
+    writer.submit(write_breakpoint_bed, identified_breakpoints, odirname)
     seq_window_size = max(seq_window_size, 1)
-    write_breakpoint_sequences(
-        genome_fname, identified_breakpoints, odirname, seq_window_size
+    writer.submit(
+        write_breakpoint_sequences,
+        genome_fname,
+        identified_breakpoints,
+        odirname,
+        seq_window_size,
     )
+    writer.join()
 
 
 if __name__ == "__main__":
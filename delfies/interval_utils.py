@@ -1,3 +1,4 @@
+import sys
 from dataclasses import dataclass
 from itertools import groupby
 from operator import itemgetter
@@ -5,17 +6,23 @@ from typing import List, Set, Tuple
 
 from delfies import REGION_DELIM1, REGION_DELIM2
 
+# Slotted dataclasses (no per-instance `__dict__`) require python >= 3.10
+SLOTTED_DATACLASS = dict(slots=True) if sys.version_info >= (3, 10) else dict()
 
-@dataclass
+
+@dataclass(**SLOTTED_DATACLASS)
 class Interval:
     name: str
     start: int = None
     end: int = None
 
     def spans(self, query_pos: int) -> bool:
-        if not self.has_coordinates():
+        # Called for each softclipped read: avoids a `has_coordinates` call and
+        # repeated attribute lookups
+        start, end = self.start, self.end
+        if start is None or end is None:
             raise ValueError("Interval object has not been assigned coordinates")
-        return self.start <= query_pos <= self.end
+        return start <= query_pos <= end
 
     def overlaps_or_touches(self, other: "Interval") -> bool:
         return (self.start <= other.end + 1) and (other.start <= self.end + 1)
@@ -43,8 +50,18 @@ class Interval:
         return self.start is not None and self.end is not None
 
 
+@dataclass(**SLOTTED_DATACLASS)
+class ContigChunk(Interval):
+    """
+    One of the consecutive, non-overlapping intervals a contig gets split into
+    (see `split_contig`). Positions in a chunk belong to it alone.
+    """
+
+
 Intervals = List[Interval]
 
+BED_HEADER_PREFIXES = ("#", "track", "browser")
+
 
 def parse_region_string(region_string: str) -> Tuple[str, int, int]:
     contig, regs = region_string.split(REGION_DELIM1)
@@ -52,6 +69,39 @@ def parse_region_string(region_string: str) -> Tuple[str, int, int]:
     return contig, start, stop
 
 
+def read_bed(bed_fname: str) -> Intervals:
+    """
+    Reads the first three columns (contig, start, end) of each BED record,
+    skipping blank, comment and header ('track'/'browser') lines.
+    """
+    result = list()
+    with open(bed_fname) as bed_fstream:
+        for line in bed_fstream:
+            if line.strip() == "" or line.startswith(BED_HEADER_PREFIXES):
+                continue
+            contig, start, end = line.split()[:3]
+            result.append(Interval(contig, int(start), int(end)))
+    return result
+
+
+def split_contig(contig: str, contig_length: int, chunk_size: int) -> Intervals:
+    """
+    Splits a contig into consecutive, non-overlapping intervals of at most `chunk_size`
+    positions (ends are inclusive).
+    The first and last intervals extend one position past the contig ends, so that
+    softclips starting just outside the contig (positions -1 and `contig_length`)
+    are still attributed to an interval.
+    """
+    result = [
+        ContigChunk(contig, start, min(start + chunk_size, contig_length) - 1)
+        for start in range(0, contig_length, chunk_size)
+    ]
+    if len(result) > 0:
+        result[0].start = -1
+        result[-1].end = contig_length
+    return result
+
+
 def get_contiguous_ranges(input_nums: Set[int]) -> List[Tuple[int, int]]:
     """
     Credit: https://stackoverflow.com/a/2154437/12519542
@@ -1,6 +1,8 @@
-import re
 from dataclasses import dataclass
+from functools import lru_cache
 from random import choice as random_choice
+from types import MappingProxyType
+from typing import Iterator, Mapping, Tuple
 
 from pyfastx import Fasta
 
@@ -57,6 +59,35 @@ def cyclic_shifts(input_str: str):
     return result
 
 
+@lru_cache(maxsize=None)
+def get_query_patterns(query_sequence: str) -> Mapping[Orientation, str]:
+    """
+    Cached, as the same query gets searched for in many regions
+    (e.g. around each putative breakpoint). The result is read-only, as it is
+    shared between all callers.
+    """
+    return MappingProxyType(
+        {
+            Orientation.forward: query_sequence,
+            Orientation.reverse: rev_comp(query_sequence),
+        }
+    )
+
+
+def find_exact_matches(query: str, target: str) -> Iterator[Tuple[int, int]]:
+    """
+    Yields the (0-based, end-exclusive) coordinates of non-overlapping occurrences of
+    `query` in `target`, using `str.find` (C-level substring search) rather than a regex.
+    """
+    query_length = len(query)
+    if query_length == 0:
+        return
+    match_start = target.find(query)
+    while match_start != -1:
+        yield match_start, match_start + query_length
+        match_start = target.find(query, match_start + query_length)
+
+
 def find_all_occurrences_in_genome(
     query_sequence: str,
     genome_fasta: Fasta,
@@ -64,31 +95,28 @@ def find_all_occurrences_in_genome(
     interval_window_size: int,
 ) -> Intervals:
     result = list()
-    patterns = {
-        Orientation.forward: re.compile(query_sequence),
-        Orientation.reverse: re.compile(rev_comp(query_sequence)),
-    }
+    patterns = get_query_patterns(query_sequence)
     for seq_region in seq_regions:
+        chrom_seq = genome_fasta[seq_region.name]
+        chrom_length = len(chrom_seq)
         if seq_region.has_coordinates():
             relative_to_absolute = seq_region.start
-            target_seq = genome_fasta[seq_region.name][
-                seq_region.start : seq_region.end
-            ]
+            target_seq = str(chrom_seq[seq_region.start : seq_region.end])
         else:
             relative_to_absolute = 0
-            target_seq = genome_fasta[seq_region.name]
-        chrom_length = len(genome_fasta[seq_region.name])
+            target_seq = str(chrom_seq)
         for orientation, pattern in patterns.items():
             match = None
-            for match in pattern.finditer(str(target_seq)):
+            for match in find_exact_matches(pattern, target_seq):
+                match_start, match_end = match
                 new_interval = Interval(
                     name=seq_region.name,
                     start=max(
-                        0, match.start() + relative_to_absolute - interval_window_size
+                        0, match_start + relative_to_absolute - interval_window_size
                     ),
                     end=min(
                         chrom_length - 1,
-                        match.end() + relative_to_absolute - 1 + interval_window_size,
+                        match_end + relative_to_absolute - 1 + interval_window_size,
                     ),
                 )
                 if len(result) == 0:
@@ -1,3 +1,6 @@
+import os
+import sys
+
 import pytest
 from pysam import CMATCH, CSOFT_CLIP, AlignedSegment
 
@@ -5,6 +8,7 @@ from delfies import Orientation
 from delfies.SAM_utils import (
     FLAGS,
     SoftclippedRead,
+    advise_sequential_reads,
     find_softclip_at_extremity,
     read_flag_matches,
 )
@@ -110,3 +114,17 @@ class TestSoftclipDetection:
             )
             is None
         )
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="posix_fadvise is Linux-specific"
+)
+def test_advise_sequential_reads_on_opened_file(tmp_path):
+    fname = tmp_path / "reads.bam"
+    fname.write_bytes(b"")
+    assert advise_sequential_reads(str(fname)) == 0
+    fd = os.open(fname, os.O_RDONLY)
+    try:
+        assert advise_sequential_reads(str(fname)) == 1
+    finally:
+        os.close(fd)
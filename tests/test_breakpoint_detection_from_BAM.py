@@ -1,16 +1,27 @@
+import gzip
 from dataclasses import dataclass
 from pathlib import Path
 from random import choice as rand_choice
 from tempfile import NamedTemporaryFile
 
 import pytest
+from click.testing import CliRunner
+from datasci import Tents
 from pysam import AlignedSegment, AlignmentFile
 from pysam import index as pysam_index
 from pysam import qualitystring_to_array
 
+import delfies.delfies as delfies_main
 from delfies import BreakpointType, Orientation
 from delfies.breakpoint_foci import BreakpointDetectionParams, find_breakpoint_foci
-from delfies.interval_utils import Interval
+from delfies.delfies import (
+    BackgroundWriter,
+    get_decompression_threads,
+    main,
+    run_breakpoint_detection,
+    sort_foci_by_position,
+)
+from delfies.interval_utils import Interval, split_contig
 from delfies.SAM_utils import DEFAULT_MIN_MAPQ, DEFAULT_READ_FILTER_FLAG
 from delfies.seq_utils import randomly_substitute, rev_comp
 from delfies.telomere_utils import TELOMERE_SEQS
@@ -148,3 +159,182 @@ def test_forward_breakpoint_S2G(read_generator, genome_interval, detection_param
         breakpoint_focus.num_supporting_reads__forward
         == DEFAULT_NUM_TELO_CONTAINING_READS
     )
+
+
+def test_forward_breakpoint_S2G_from_opened_BAM(
+    read_generator, genome_interval, detection_params
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    with AlignmentFile(detection_params.bam_fname, threads=2) as bam_fstream:
+        foci = find_breakpoint_foci(detection_params, genome_interval, bam_fstream)
+    filtered_foci = [
+        elem for elem in foci if elem.start == EXPECTED_BREAKPOINT_POSITION
+    ]
+    assert len(filtered_foci) == 1
+    assert (
+        filtered_foci[0].num_supporting_reads__forward
+        == DEFAULT_NUM_TELO_CONTAINING_READS
+    )
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_forward_breakpoint_S2G_multiple_regions(
+    read_generator, detection_params, tmp_path, threads
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    detection_params.ofname_base = tmp_path / "breakpoint_foci"
+    seq_regions = [
+        Interval(DEFAULT_CHROM, 0, EXPECTED_BREAKPOINT_POSITION - 10),
+        Interval(DEFAULT_CHROM, EXPECTED_BREAKPOINT_POSITION - 10, 5000),
+    ]
+    putative_breakpoints = run_breakpoint_detection(
+        detection_params, seq_regions, threads
+    )
+    assert len(putative_breakpoints) == 1
+    putative_breakpoint = putative_breakpoints[0]
+    assert putative_breakpoint.orientation is Orientation.forward
+    assert putative_breakpoint.focus.start == EXPECTED_BREAKPOINT_POSITION
+    assert putative_breakpoint.max_value == DEFAULT_NUM_TELO_CONTAINING_READS
+    foci = Tents.from_tsv(f"{detection_params.ofname_base}.tsv.gz")
+    assert EXPECTED_BREAKPOINT_POSITION in [int(focus.start) for focus in foci]
+
+
+def test_foci_tsv_written_in_background(read_generator, detection_params, tmp_path):
+    detection_params.bam_fname = read_generator.write_BAM()
+    detection_params.ofname_base = tmp_path / "breakpoint_foci"
+    writer = BackgroundWriter()
+    putative_breakpoints = run_breakpoint_detection(
+        detection_params, [Interval(DEFAULT_CHROM)], threads=1, writer=writer
+    )
+    writer.join()
+    assert len(putative_breakpoints) == 1
+    foci = Tents.from_tsv(f"{detection_params.ofname_base}.tsv.gz")
+    assert EXPECTED_BREAKPOINT_POSITION in [int(focus.start) for focus in foci]
+
+
+def test_foci_tsv_rows_are_in_genomic_order(read_generator, detection_params, tmp_path):
+    detection_params.bam_fname = read_generator.write_BAM()
+    seq_regions = [
+        Interval(DEFAULT_CHROM, 900, 1100),
+        Interval(DEFAULT_CHROM, 0, 2000),
+        Interval(DEFAULT_CHROM, 500, 5000),
+    ]
+    foci_tsvs = list()
+    for threads in [1, 2]:
+        detection_params.ofname_base = tmp_path / f"breakpoint_foci_{threads}"
+        run_breakpoint_detection(detection_params, seq_regions, threads)
+        foci_tsvs.append(f"{detection_params.ofname_base}.tsv.gz")
+    with gzip.open(foci_tsvs[0], "rt") as fin_1, gzip.open(foci_tsvs[1], "rt") as fin_2:
+        rows = fin_2.read().splitlines()
+        assert fin_1.read().splitlines() == rows
+    # Each region records the breakpoint and two positions either side of it, which
+    # get output once
+    starts = [int(row.split("\t")[1]) for row in rows[1:]]
+    assert starts == list(
+        range(EXPECTED_BREAKPOINT_POSITION - 2, EXPECTED_BREAKPOINT_POSITION + 3)
+    )
+
+
+def test_decompression_threads_use_spare_requested_threads(
+    read_generator, detection_params, monkeypatch, tmp_path
+):
+    budget_calls = list()
+
+    def recording_get_decompression_threads(num_processes, thread_budget):
+        budget_calls.append((num_processes, thread_budget))
+        return get_decompression_threads(num_processes, thread_budget)
+
+    monkeypatch.setattr(
+        delfies_main, "get_decompression_threads", recording_get_decompression_threads
+    )
+    detection_params.bam_fname = read_generator.write_BAM()
+    detection_params.ofname_base = tmp_path / "breakpoint_foci"
+    seq_regions = [
+        Interval(DEFAULT_CHROM, 0, 2000),
+        Interval(DEFAULT_CHROM, 2001, 5000),
+    ]
+    run_breakpoint_detection(detection_params, seq_regions, threads=6)
+    run_breakpoint_detection(detection_params, seq_regions[:1], threads=3)
+    # Two workers share the 6 requested threads; a single region runs in-process
+    assert budget_calls == [(2, 6), (1, 3)]
+
+
+def test_forward_breakpoint_S2G_at_chunk_boundary_is_counted_once(
+    read_generator, detection_params
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    chunks = split_contig(
+        DEFAULT_CHROM, int(DEFAULT_CHROM_LENGTH), EXPECTED_BREAKPOINT_POSITION
+    )
+    breakpoint_foci = [
+        focus
+        for chunk in chunks
+        for focus in find_breakpoint_foci(detection_params, chunk)
+        if focus.start == EXPECTED_BREAKPOINT_POSITION
+        and focus.num_supporting_reads__forward > 0
+    ]
+    assert len(breakpoint_foci) == 1
+    assert (
+        breakpoint_foci[0].num_supporting_reads__forward
+        == DEFAULT_NUM_TELO_CONTAINING_READS
+    )
+
+
+def test_foci_just_outside_requested_region_are_reported(
+    read_generator, detection_params
+):
+    """
+    Only contig chunks restrict softclips and read depth to their own positions
+    """
+    detection_params.bam_fname = read_generator.write_BAM()
+    seq_region = Interval(DEFAULT_CHROM, 900, EXPECTED_BREAKPOINT_POSITION - 1)
+    foci = find_breakpoint_foci(detection_params, seq_region)
+    breakpoint_foci = [
+        focus for focus in foci if focus.start == EXPECTED_BREAKPOINT_POSITION
+    ]
+    assert len(breakpoint_foci) == 1
+    assert breakpoint_foci[0].num_supporting_reads__forward > 0
+    assert len(foci) == 5
+
+
+@pytest.mark.parametrize(
+    "chunk_size",
+    [
+        EXPECTED_BREAKPOINT_POSITION - 1,
+        EXPECTED_BREAKPOINT_POSITION,
+        EXPECTED_BREAKPOINT_POSITION + 1,
+        EXPECTED_BREAKPOINT_POSITION + 3,
+    ],
+)
+def test_split_contig_gives_same_foci_as_unsplit_contig(
+    read_generator, detection_params, chunk_size
+):
+    detection_params.bam_fname = read_generator.write_BAM()
+    unsplit_foci = find_breakpoint_foci(detection_params, Interval(DEFAULT_CHROM))
+    chunks = split_contig(DEFAULT_CHROM, int(DEFAULT_CHROM_LENGTH), chunk_size)
+    split_foci = sort_foci_by_position(
+        [find_breakpoint_foci(detection_params, chunk) for chunk in chunks],
+        [DEFAULT_CHROM],
+    )
+    expected = sort_foci_by_position([unsplit_foci], [DEFAULT_CHROM])
+    assert len(expected) == 5
+    assert list(map(repr, split_foci)) == list(map(repr, expected))
+
+
+def test_breakpoint_detection_command_line(read_generator, tmp_path):
+    bam_fname = read_generator.write_BAM()
+    genome_fname = tmp_path / "genome.fasta"
+    genome_fname.write_text(f">{DEFAULT_CHROM}\n{'A' * int(DEFAULT_CHROM_LENGTH)}\n")
+    odirname = tmp_path / "output"
+    result = CliRunner().invoke(
+        main, [str(genome_fname), bam_fname, str(odirname), "--threads", "2"]
+    )
+    assert result.exit_code == 0, result.output
+    bed_lines = (odirname / "breakpoint_locations.bed").read_text().splitlines()
+    assert len(bed_lines) == 1
+    contig, start, _, name, read_support, strand = bed_lines[0].split("\t")
+    assert contig == DEFAULT_CHROM
+    assert int(start) == EXPECTED_BREAKPOINT_POSITION
+    assert name.startswith(f"Type:{BreakpointType.S2G}")
+    assert int(read_support) == DEFAULT_NUM_TELO_CONTAINING_READS
+    assert strand == Orientation.forward.value
@@ -1,3 +1,5 @@
+import gzip
+
 import pytest
 from pysam import AlignedSegment, AlignmentHeader
 
@@ -9,6 +11,7 @@ from delfies.breakpoint_foci import (
     cluster_breakpoint_foci,
     record_softclips,
     setup_breakpoint_tents,
+    write_breakpoint_foci,
 )
 from delfies.interval_utils import Interval
 from delfies.SAM_utils import DEFAULT_MIN_MAPQ, DEFAULT_READ_FILTER_FLAG
@@ -180,6 +183,42 @@ class TestBreakpointClustering:
         assert result[1].Min == 2000
         assert result[1].Max == 2005
 
+    def test_cluster_breakpoint_foci_is_independent_of_input_order(
+        self, multiple_breakpoint_foci
+    ):
+        reversed_foci = setup_breakpoint_tents()
+        for focus in reversed(list(multiple_breakpoint_foci)):
+            reversed_foci.add(focus)
+        result = cluster_breakpoint_foci(multiple_breakpoint_foci, tolerance=10)
+        reversed_result = cluster_breakpoint_foci(reversed_foci, tolerance=10)
+        assert [(w.Min, w.Max) for w in result] == [
+            (w.Min, w.Max) for w in reversed_result
+        ]
+
+    def test_cluster_breakpoint_foci_on_different_contigs(
+        self, multiple_breakpoint_foci
+    ):
+        multiple_breakpoint_foci[1].contig = "other_contig"
+        result = cluster_breakpoint_foci(multiple_breakpoint_foci, tolerance=10)
+        assert len(result) == 3
+
+
+class TestWriteBreakpointFoci:
+    def test_write_breakpoint_foci(self, multiple_breakpoint_foci, tmp_path):
+        for focus in multiple_breakpoint_foci:
+            focus.update(read_depth=30, breakpoint_type="S2G")
+        foci_tsv = str(tmp_path / "foci.tsv.gz")
+        write_breakpoint_foci(multiple_breakpoint_foci, foci_tsv)
+        with gzip.open(foci_tsv, "rt") as fin:
+            assert fin.read() == f"{multiple_breakpoint_foci}\n"
+
+    def test_write_no_breakpoint_foci(self, tmp_path):
+        foci = setup_breakpoint_tents()
+        foci_tsv = str(tmp_path / "foci.tsv.gz")
+        write_breakpoint_foci(foci, foci_tsv)
+        with gzip.open(foci_tsv, "rt") as fin:
+            assert fin.read() == f"{foci}\n"
+
 
 DEFAULT_TELO_SEQ = TELOMERE_SEQS["Nematoda"][Orientation.forward]
 DEFAULT_TELO_ARRAY_SIZE = 3
@@ -0,0 +1,272 @@
+import multiprocessing as mp
+import os
+import sys
+
+import pytest
+from click.testing import CliRunner
+from pysam import AlignmentFile
+from pysam import index as pysam_index
+
+import delfies.delfies as delfies_main
+from delfies import BreakpointType, Orientation, PutativeBreakpoint
+from delfies.breakpoint_foci import BreakpointDetectionParams, setup_breakpoint_tents
+from delfies.delfies import (
+    BackgroundWriter,
+    _init_worker,
+    get_decompression_threads,
+    get_worker_cpu_sets,
+    main,
+    run_breakpoint_detection,
+    sort_regions_by_size,
+    split_long_contigs,
+    write_breakpoint_bed,
+)
+from delfies.interval_utils import Interval, split_contig
+from delfies.SAM_utils import DEFAULT_MIN_MAPQ, DEFAULT_READ_FILTER_FLAG
+from delfies.seq_utils import rev_comp
+from delfies.telomere_utils import TELOMERE_SEQS
+
+DEFAULT_CHROM = "chr1"
+DEFAULT_CHROM_LENGTH = 10000
+DEFAULT_TELO_SEQ = TELOMERE_SEQS["Nematoda"][Orientation.forward]
+
+
+@pytest.fixture
+def genome_and_BAM(tmp_path):
+    """
+    A genome containing a telomere array, and a BAM without any reads aligned to it
+    """
+    genome_fname = tmp_path / "genome.fasta"
+    telo_array = DEFAULT_TELO_SEQ * 20
+    contig_seq = "A" * 5000 + telo_array
+    contig_seq += "A" * (DEFAULT_CHROM_LENGTH - len(contig_seq))
+    genome_fname.write_text(f">{DEFAULT_CHROM}\n{contig_seq}\n")
+    bam_fname = tmp_path / "reads.bam"
+    header = {
+        "HD": {"VN": "1.0"},
+        "SQ": [{"LN": DEFAULT_CHROM_LENGTH, "SN": DEFAULT_CHROM}],
+    }
+    with AlignmentFile(str(bam_fname), "wb", header=header):
+        pass
+    pysam_index(str(bam_fname))
+    return str(genome_fname), str(bam_fname)
+
+
+@pytest.fixture
+def detection_params(genome_and_BAM):
+    telomere_seqs = {
+        Orientation.forward: DEFAULT_TELO_SEQ,
+        Orientation.reverse: rev_comp(DEFAULT_TELO_SEQ),
+    }
+    return BreakpointDetectionParams(
+        bam_fname=genome_and_BAM[1],
+        telomere_seqs=telomere_seqs,
+        telo_array_size=10,
+        max_edit_distance=0,
+        clustering_threshold=1,
+        min_mapq=DEFAULT_MIN_MAPQ,
+        read_filter_flag=DEFAULT_READ_FILTER_FLAG,
+        min_supporting_reads=10,
+        breakpoint_type=BreakpointType.S2G,
+    )
+
+
+@pytest.fixture
+def analysed_regions(monkeypatch):
+    """
+    Records the regions each breakpoint type gets analysed in, without running detection
+    """
+    result = dict()
+
+    def recording_run_breakpoint_detection(detection_params, seq_regions, *args):
+        result[detection_params.breakpoint_type] = seq_regions
+        return list()
+
+    monkeypatch.setattr(
+        delfies_main, "run_breakpoint_detection", recording_run_breakpoint_detection
+    )
+    return result
+
+
+def make_putative_breakpoint(
+    position: int, read_support: int, breakpoint_type: BreakpointType
+) -> PutativeBreakpoint:
+    focus = setup_breakpoint_tents().new()
+    focus.update(contig=DEFAULT_CHROM, start=position, end=position + 1)
+    return PutativeBreakpoint(
+        Orientation.forward,
+        read_support,
+        0,
+        0,
+        (position, position),
+        focus,
+        breakpoint_type,
+    )
+
+
+class TestRegionScheduling:
+    def test_split_long_contigs(self):
+        seq_regions = [
+            Interval("contig_1"),
+            Interval("contig_2"),
+            Interval("contig_3", 0, 100),
+        ]
+        contig_lengths = {"contig_1": 5, "contig_2": 25, "contig_3": 200}
+        result = split_long_contigs(seq_regions, contig_lengths, chunk_size=10)
+        assert result[0] == Interval("contig_1")
+        assert result[1:4] == split_contig("contig_2", 25, 10)
+        assert result[4] == Interval("contig_3", 0, 100)
+
+    def test_sort_regions_by_size(self):
+        seq_regions = [
+            Interval("contig_1", 0, 10),
+            Interval("contig_2"),
+            Interval("contig_3", 100, 1000),
+        ]
+        result = sort_regions_by_size(seq_regions, {"contig_2": 500})
+        assert [seq_region.name for seq_region in result] == [
+            "contig_3",
+            "contig_2",
+            "contig_1",
+        ]
+
+
+@pytest.mark.parametrize(
+    "num_processes,thread_budget,expected",
+    [(1, 1, 0), (1, 2, 1), (1, 16, 2), (4, 4, 0), (4, 8, 1), (4, 16, 2), (8, 4, 0)],
+)
+def test_decompression_threads_stay_within_thread_budget(
+    num_processes, thread_budget, expected
+):
+    assert get_decompression_threads(num_processes, thread_budget) == expected
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="CPU pinning is Linux-specific"
+)
+class TestWorkerCPUPinning:
+    def test_worker_cpu_sets_are_disjoint_blocks(self, monkeypatch):
+        monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1, 2, 3, 4})
+        assert get_worker_cpu_sets(2) == [{0, 1}, {2, 3}]
+
+    def test_no_worker_cpu_sets_if_more_workers_than_cpus(self, monkeypatch):
+        monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0})
+        assert get_worker_cpu_sets(2) is None
+
+    def test_workers_get_pinned_to_their_own_cpu_set(
+        self, detection_params, monkeypatch
+    ):
+        # Restored after the test, so workers' state does not leak into other tests
+        monkeypatch.setattr(delfies_main, "_worker_detection_params", None)
+        monkeypatch.setattr(delfies_main, "_worker_bam_fstream", None)
+        monkeypatch.setattr(
+            delfies_main, "open_bam_for_detection", lambda *args: "bam_fstream"
+        )
+        affinity_calls = list()
+        monkeypatch.setattr(
+            os, "sched_setaffinity", lambda pid, cpus: affinity_calls.append(cpus)
+        )
+        worker_cpu_sets = [{0, 1}, {2, 3}]
+        worker_counter = mp.Value("i", 0)
+        for _ in range(2):
+            _init_worker(detection_params, 0, worker_cpu_sets, worker_counter)
+        assert affinity_calls == worker_cpu_sets
+        assert delfies_main._worker_bam_fstream == "bam_fstream"
+
+    def test_warning_if_pinning_is_skipped(
+        self, detection_params, monkeypatch, tmp_path
+    ):
+        monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0})
+        detection_params.ofname_base = tmp_path / "breakpoint_foci"
+        seq_regions = [
+            Interval(DEFAULT_CHROM, 0, 2000),
+            Interval(DEFAULT_CHROM, 2001, 5000),
+        ]
+        with pytest.warns(UserWarning, match="Not pinning threads"):
+            run_breakpoint_detection(
+                detection_params, seq_regions, threads=2, pin_threads=True
+            )
+
+
+class TestBackgroundWriter:
+    def test_background_writer_reraises_errors(self):
+        def failing_write():
+            raise OSError("disk full")
+
+        writer = BackgroundWriter()
+        writer.submit(failing_write)
+        with pytest.raises(OSError):
+            writer.join()
+
+
+class TestWriteBreakpointBed:
+    def test_write_breakpoint_bed(self, tmp_path):
+        tents = setup_breakpoint_tents()
+        focus = tents.new()
+        focus.update(contig="scaffold_1", start=3, end=4)
+        putative_breakpoints = [
+            PutativeBreakpoint(Orientation.forward, 12, 0, 0, (2, 5), focus, "S2G"),
+            PutativeBreakpoint(Orientation.reverse, 10, 0, 0, (3, 3), focus, "G2S"),
+        ]
+        write_breakpoint_bed(putative_breakpoints, tmp_path)
+        expected = (
+            "scaffold_1\t3\t4\tType:S2G;breakpoint_window:2-5\t12\t+\n"
+            "scaffold_1\t3\t4\tType:G2S;breakpoint_window:3-3\t10\t-\n"
+        )
+        assert (tmp_path / "breakpoint_locations.bed").read_text() == expected
+
+
+class TestMain:
+    def test_breakpoint_types_analysed_after_G2S_use_all_requested_regions(
+        self, genome_and_BAM, analysed_regions, monkeypatch, tmp_path
+    ):
+        monkeypatch.setattr(
+            delfies_main,
+            "all_breakpoint_types",
+            [BreakpointType.G2S, BreakpointType.S2G],
+        )
+        genome_fname, bam_fname = genome_and_BAM
+        result = CliRunner().invoke(
+            main, [genome_fname, bam_fname, str(tmp_path / "output")]
+        )
+        assert result.exit_code == 0, result.output
+        assert list(analysed_regions) == [BreakpointType.G2S, BreakpointType.S2G]
+        G2S_regions = analysed_regions[BreakpointType.G2S]
+        assert len(G2S_regions) > 0
+        assert all(seq_region.has_coordinates() for seq_region in G2S_regions)
+        assert analysed_regions[BreakpointType.S2G] == [Interval(DEFAULT_CHROM)]
+
+    def test_breakpoints_of_all_types_are_written_by_decreasing_read_support(
+        self, genome_and_BAM, monkeypatch, tmp_path
+    ):
+        # Each type's breakpoints come sorted by decreasing read support, as in
+        # `run_breakpoint_detection`
+        breakpoints_per_type = {
+            BreakpointType.S2G: [(1000, 12), (2000, 8), (3000, 3)],
+            BreakpointType.G2S: [(8000, 10), (9000, 5)],
+        }
+
+        def mock_run_breakpoint_detection(detection_params, seq_regions, *args):
+            breakpoint_type = detection_params.breakpoint_type
+            return [
+                make_putative_breakpoint(position, read_support, breakpoint_type)
+                for position, read_support in breakpoints_per_type[breakpoint_type]
+            ]
+
+        monkeypatch.setattr(
+            delfies_main, "run_breakpoint_detection", mock_run_breakpoint_detection
+        )
+        genome_fname, bam_fname = genome_and_BAM
+        odirname = tmp_path / "output"
+        result = CliRunner().invoke(main, [genome_fname, bam_fname, str(odirname)])
+        assert result.exit_code == 0, result.output
+        bed_lines = (odirname / "breakpoint_locations.bed").read_text().splitlines()
+        bed_fields = [bed_line.split("\t") for bed_line in bed_lines]
+        assert [int(fields[4]) for fields in bed_fields] == [12, 10, 8, 5, 3]
+        assert [int(fields[1]) for fields in bed_fields] == [
+            1000,
+            8000,
+            2000,
+            9000,
+            3000,
+        ]
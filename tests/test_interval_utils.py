@@ -1,7 +1,16 @@
+import sys
+
 import pytest
 from pybedtools import Interval as pybedtools_Interval
 
-from delfies.interval_utils import Interval, get_contiguous_ranges, parse_region_string
+from delfies.interval_utils import (
+    ContigChunk,
+    Interval,
+    get_contiguous_ranges,
+    parse_region_string,
+    read_bed,
+    split_contig,
+)
 
 EXAMPLE_INVALID_REGION_STRING = "chr1:2--200"
 EXAMPLE_VALID_REGION_STRING = "chr1:2-200"
@@ -57,6 +66,20 @@ class TestIntervalConstruction:
         result = Interval.from_pybedtools_interval(pb_interval)
         assert result == test_interval
 
+    def test_build_intervals_from_bed(self, test_interval, tmp_path):
+        bed_fname = tmp_path / "regions.bed"
+        bed_fname.write_text(
+            "track name=regions\n# comment\nchr1\t2\t200\n\nchr2\t0\t10\tname\t0\t+\n"
+        )
+        result = read_bed(str(bed_fname))
+        assert result == [test_interval, Interval("chr2", 0, 10)]
+
+    @pytest.mark.skipif(
+        sys.version_info < (3, 10), reason="Slotted dataclasses need python >= 3.10"
+    )
+    def test_interval_has_no_instance_dict(self, test_interval):
+        assert not hasattr(test_interval, "__dict__")
+
     def test_interval_to_region_string(self, test_interval):
         assert test_interval.to_region_string() == EXAMPLE_VALID_REGION_STRING
         test_interval.start = None
@@ -85,3 +108,18 @@ class TestIntervalCoordinates:
         assert test_interval.spans(test_interval.end)
         assert not test_interval.spans(test_interval.start - 1)
         assert not test_interval.spans(test_interval.end + 1)
+
+
+class TestContigSplitting:
+    def test_split_contig_shorter_than_chunk_size(self):
+        result = split_contig("chr1", 10, chunk_size=20)
+        assert result == [ContigChunk("chr1", -1, 10)]
+
+    def test_split_contig_into_multiple_chunks(self):
+        result = split_contig("chr1", 25, chunk_size=10)
+        expected = [
+            ContigChunk("chr1", -1, 9),
+            ContigChunk("chr1", 10, 19),
+            ContigChunk("chr1", 20, 25),
+        ]
+        assert result == expected
@@ -1,9 +1,12 @@
 import pytest
 
+from delfies import Orientation
 from delfies.interval_utils import Interval
 from delfies.seq_utils import (
     cyclic_shifts,
     find_all_occurrences_in_genome,
+    find_exact_matches,
+    get_query_patterns,
     randomly_substitute,
     rev_comp,
 )
@@ -53,6 +56,23 @@ def test_cyclic_shifts():
     assert result == expected_shifts
 
 
+def test_find_exact_matches_are_non_overlapping():
+    result = list(find_exact_matches("AA", "AAAACAA"))
+    assert result == [(0, 2), (2, 4), (5, 7)]
+
+
+def test_find_exact_matches_empty_query():
+    assert list(find_exact_matches("", "ACGT")) == []
+
+
+def test_cached_query_patterns_are_read_only():
+    patterns = get_query_patterns("TTAGGC")
+    assert patterns[Orientation.reverse] == "GCCTAA"
+    with pytest.raises(TypeError):
+        patterns[Orientation.forward] = "AAAAAA"
+    assert get_query_patterns("TTAGGC")[Orientation.forward] == "TTAGGC"
+
+
 class TestFindOccurrencesInGenomePerfectTeloArrays(ClassWithTempFasta):
     chrom_name = "chr1"
     telo_unit = "TTAGGC"